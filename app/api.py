@@ -1,10 +1,14 @@
-from enum import Enum
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
 
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security.http import HTTPAuthorizationCredentials, HTTPBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, confloat
 
-from . import model
+from . import export, journal, model
+from .auth import require_admin
 from .model import (
     JoinRoomResult,
     LiveDifficulty,
@@ -20,8 +24,28 @@ from .model import (
     start_room,
     wait_room,
 )
+from .negotiation import MsgPackRoute, NegotiatedResponse, exception_handlers
+from .profiler import ProfilingRoute, profiler
+
+
+class Route(MsgPackRoute, ProfilingRoute):
+    """MessagePack に対応し, プロファイル可能なルート"""
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    journal.open_journal(model.load_rooms)  # ジャーナルからルームの状態を復元
+    yield
+    journal.close_journal()
+
+
+app = FastAPI(
+    default_response_class=NegotiatedResponse,
+    exception_handlers=exception_handlers,  # エラーも Accept に応じて返す
+    lifespan=lifespan,
+)
+app.router.route_class = Route  # 以降に登録するルートに適用する
 
-app = FastAPI()
 
 # Sample APIs
 
@@ -190,3 +214,105 @@ def room_leave(req: RoomLeaveRequest, token: str = Depends(get_auth_token)):
     """ルームを退出する, ホストが叩く場合は適当な同じ部屋のユーザーをホストにする"""
     leave_room(token, req.room_id)
     return {}
+
+
+# Admin APIs
+
+
+class ProfileConfigRequest(BaseModel):
+    enabled: bool
+    sample_rate: Optional[confloat(ge=0, le=1)] = None
+
+
+class ProfileStatusResponse(BaseModel):
+    enabled: bool
+    sample_rate: float
+    route_sample_count: dict[str, int]
+
+
+def _profile_status() -> ProfileStatusResponse:
+    return ProfileStatusResponse(
+        enabled=profiler.enabled,
+        sample_rate=profiler.sample_rate,
+        route_sample_count=profiler.routes(),
+    )
+
+
+@app.get(
+    "/admin/profile",
+    response_model=ProfileStatusResponse,
+    dependencies=[Depends(require_admin)],
+)
+def admin_profile_status():
+    """プロファイラの状態とルートごとのサンプル数"""
+    return _profile_status()
+
+
+@app.post(
+    "/admin/profile",
+    response_model=ProfileStatusResponse,
+    dependencies=[Depends(require_admin)],
+)
+def admin_profile_config(req: ProfileConfigRequest):
+    """プロファイラの有効化・無効化, サンプリング割合の変更"""
+    profiler.configure(req.enabled, req.sample_rate)
+    return _profile_status()
+
+
+@app.delete(
+    "/admin/profile", response_model=Empty, dependencies=[Depends(require_admin)]
+)
+def admin_profile_reset():
+    """集計済みのスタックとキャプチャを破棄"""
+    profiler.reset()
+    return {}
+
+
+@app.get(
+    "/admin/profile/flamegraph",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin)],
+)
+def admin_profile_flamegraph(route: Optional[str] = None):
+    """折りたたみスタック形式でダウンロード, flamegraph.pl や speedscope で可視化できる"""
+    return PlainTextResponse(
+        profiler.collapsed(route),
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"'},
+    )
+
+
+@app.get(
+    "/admin/profile/capture/{capture_id}",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin)],
+)
+def admin_profile_capture(capture_id: str):
+    """X-Profile-Capture ヘッダーで計測したリクエストの cProfile の結果"""
+    stats = profiler.get_capture(capture_id)
+    if stats is None:
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(stats)
+
+
+@app.get("/export/results", dependencies=[Depends(require_admin)])
+def export_results(
+    format: export.ExportFormat = export.ExportFormat.ndjson,
+    live_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """プレイ結果を NDJSON / CSV でストリーミング, since 以上 until 未満"""
+    if format == export.ExportFormat.parquet:  # ファイルへの出力のみ
+        raise HTTPException(status_code=400, detail="use python -m app.export")
+    chunks = export.iter_results(live_id, since, until)
+    if format == export.ExportFormat.csv:
+        body, media_type = export.to_csv(chunks), "text/csv"
+    else:
+        body, media_type = export.to_ndjson(chunks), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="results.{format.value}"'
+        },
+    )
@@ -0,0 +1,25 @@
+import secrets
+
+from fastapi import Header, HTTPException
+
+from . import config
+
+
+def _matches(value: str, secret: str) -> bool:
+    if not secret:  # 未設定なら常に拒否する
+        return False
+    # str のままだと非 ASCII の文字(ヘッダーは latin-1 で読まれる)で TypeError になる
+    return secrets.compare_digest(value.encode(), secret.encode())
+
+
+def is_admin_token(token: str) -> bool:
+    return _matches(token, config.ADMIN_TOKEN)
+
+
+def is_capture_key(key: str) -> bool:
+    return _matches(key, config.PROFILE_CAPTURE_KEY)
+
+
+def require_admin(x_admin_token: str = Header("")) -> None:
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403)
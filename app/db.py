@@ -1,5 +1,109 @@
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
 
 from . import config
 
 engine = create_engine(config.DATABASE_URI, future=True, echo=True)
+
+
+def replica_lag(replica: Engine) -> Optional[float]:
+    """レプリカの遅延(秒), 取得できない(レプリケーションが止まっている)場合は None"""
+    try:
+        with replica.connect() as conn:
+            row = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+    except Exception:
+        return None
+    if row is None or row["Seconds_Behind_Source"] is None:
+        return None
+    return float(row["Seconds_Behind_Source"])
+
+
+class ReplicaPool:
+    """読み取りを遅延の小さいレプリカに振り分ける, 使えるレプリカが無ければ primary を返す"""
+
+    def __init__(
+        self,
+        primary: Engine,
+        replicas: list[Engine],
+        max_lag: float = config.REPLICA_MAX_LAG,
+        lag_check_interval: float = config.REPLICA_LAG_CHECK_INTERVAL,
+        sticky_seconds: float = config.REPLICA_STICKY_SECONDS,
+        lag_probe: Callable[[Engine], Optional[float]] = replica_lag,
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.sticky_seconds = sticky_seconds
+        self.lag_probe = lag_probe
+        self._lock = threading.Lock()
+        self._lags: dict[int, Optional[float]] = {}  # 最後に確認した遅延
+        self._next = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def lag(self, replica: Engine) -> Optional[float]:
+        """最後に確認した遅延, まだ確認していなければ None"""
+        with self._lock:
+            return self._lags.get(id(replica))
+
+    def refresh(self) -> None:
+        """全レプリカの遅延を確認し直す"""
+        for replica in self.replicas:
+            lag = self.lag_probe(replica)
+            with self._lock:
+                self._lags[id(replica)] = lag
+
+    def _run(self) -> None:
+        while True:
+            self.refresh()
+            time.sleep(self.lag_check_interval)
+
+    def _start(self) -> None:
+        # 遅延の確認はリクエストのスレッドでは行わない, 接続できないレプリカで待たされないように
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="replica-lag", daemon=True
+                )
+                self._thread.start()
+
+    def engine_for(self, since_write: Optional[float] = None) -> Engine:
+        """since_write: 読み取るユーザーが最後に書き込んでからの秒数
+
+        書き込みがレプリカに届いていない可能性があるうちは primary を返す
+        """
+        if not self.replicas:
+            return self.primary
+        if self._thread is None:
+            self._start()
+        if since_write is not None and since_write < self.sticky_seconds:
+            return self.primary
+        start = next(self._next)
+        for i in range(len(self.replicas)):  # ラウンドロビン
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            lag = self.lag(replica)
+            if lag is None or lag > self.max_lag:
+                continue
+            if since_write is not None and since_write <= lag:
+                continue
+            return replica
+        return self.primary
+
+
+replicas = ReplicaPool(
+    engine,
+    [
+        create_engine(
+            uri,
+            future=True,
+            echo=True,
+            connect_args={"connect_timeout": config.REPLICA_CONNECT_TIMEOUT},
+        )
+        for uri in config.REPLICA_DATABASE_URIS
+    ],
+)
@@ -0,0 +1,150 @@
+"""プレイ結果のエクスポート
+
+python -m app.export --format csv --live-id 1001 --since 2026-10-01 > results.csv
+python -m app.export --format parquet --output results.parquet
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+from enum import Enum
+from typing import Iterator, Optional
+
+from sqlalchemy import text
+
+from . import config
+from .db import replicas
+
+COLUMNS = [
+    "id",
+    "user_id",
+    "room_id",
+    "live_id",
+    "select_difficulty",
+    "score",
+    "perfect",
+    "great",
+    "good",
+    "bad",
+    "miss",
+    "created_at",
+]
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+    parquet = "parquet"  # ローカルのファイルへの出力のみ
+
+
+def iter_results(
+    live_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chunk_size: int = config.EXPORT_CHUNK_SIZE,
+) -> Iterator[list[tuple]]:
+    """play_result を chunk_size 行ずつ返す, since 以上 until 未満
+
+    サーバーサイドカーソルで読むので全件をメモリに載せない. 読み取りはレプリカに送る
+    """
+    conditions = []
+    params = {}
+    if live_id is not None:
+        conditions.append("`live_id`=:live_id")
+        params["live_id"] = live_id
+    if since is not None:
+        conditions.append("`created_at`>=:since")
+        params["since"] = since
+    if until is not None:
+        conditions.append("`created_at`<:until")
+        params["until"] = until
+    query = f"SELECT {', '.join(f'`{c}`' for c in COLUMNS)} FROM `play_result`"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY `id`"
+    with replicas.engine_for().connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            text(query), params
+        )
+        for rows in result.partitions(chunk_size):
+            yield [tuple(row) for row in rows]
+
+
+def _isoformat(row: tuple) -> list:
+    row = list(row)
+    row[-1] = row[-1].isoformat()  # created_at
+    return row
+
+
+def to_ndjson(chunks: Iterator[list[tuple]]) -> Iterator[str]:
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, _isoformat(row)))) + "\n" for row in rows
+        )
+
+
+def to_csv(chunks: Iterator[list[tuple]]) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(_isoformat(row) for row in rows)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if out.tell():  # 結果が無い場合のヘッダー
+        yield out.getvalue()
+
+
+def write_parquet(chunks: Iterator[list[tuple]], path: str) -> None:
+    """チャンクごとに row group として書き出す"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("parquet の出力には pyarrow が必要です") from e
+
+    schema = pa.schema(
+        [(c, pa.int64()) for c in COLUMNS[:-1]] + [("created_at", pa.timestamp("us"))]
+    )
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="プレイ結果のエクスポート")
+    parser.add_argument(
+        "--format", type=ExportFormat, default=ExportFormat.ndjson, dest="fmt"
+    )
+    parser.add_argument("--live-id", type=int)
+    parser.add_argument("--since", type=datetime.fromisoformat, help="この時刻以降")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="この時刻より前")
+    parser.add_argument("--chunk-size", type=int, default=config.EXPORT_CHUNK_SIZE)
+    parser.add_argument("--output", "-o", help="出力先のファイル, 省略すると標準出力")
+    args = parser.parse_args(argv)
+
+    for engine in [replicas.primary, *replicas.replicas]:
+        engine.echo = False  # SQL のログが標準出力に混ざらないようにする
+    chunks = iter_results(args.live_id, args.since, args.until, args.chunk_size)
+    if args.fmt == ExportFormat.parquet:
+        if args.output is None:
+            parser.error("parquet は --output が必要です")
+        write_parquet(chunks, args.output)
+        return
+    lines = to_ndjson(chunks) if args.fmt == ExportFormat.ndjson else to_csv(chunks)
+    out = sys.stdout if args.output is None else open(args.output, "w", newline="")
+    try:
+        for line in lines:
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+import errno
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# イベント
+
+
+class CreateRoom(NamedTuple):
+    room_id: int
+    live_id: int
+    user_id: int  # ホスト
+    select_difficulty: int
+
+
+class JoinRoom(NamedTuple):
+    room_id: int
+    user_id: int
+    select_difficulty: int
+
+
+class LeaveRoom(NamedTuple):
+    room_id: int
+    user_id: int
+
+
+class TransferHost(NamedTuple):
+    room_id: int
+    user_id: int  # 新しいホスト
+
+
+class StartRoom(NamedTuple):
+    room_id: int
+
+
+class EndRoom(NamedTuple):
+    room_id: int
+    user_id: int
+    score: int
+    perfect: int
+    great: int
+    good: int
+    bad: int
+    miss: int
+
+
+# レコード: crc32(4) + 種別(1) + 本体(種別ごとの固定長)
+# crc32 は種別と本体にかかる. 種別 0 (未書き込みの領域) か crc の不一致でログの終わりとみなす
+_CODECS: dict[type, tuple[int, struct.Struct]] = {
+    CreateRoom: (1, struct.Struct("<qqqB")),
+    JoinRoom: (2, struct.Struct("<qqB")),
+    LeaveRoom: (3, struct.Struct("<qq")),
+    TransferHost: (4, struct.Struct("<qq")),
+    StartRoom: (5, struct.Struct("<q")),
+    EndRoom: (6, struct.Struct("<qqqiiiii")),
+}
+_DECODERS = {code: (cls, codec) for cls, (code, codec) in _CODECS.items()}
+_CRC = struct.Struct("<I")
+
+SNAPSHOT_MAGIC = b"RJSNAP01"
+_SNAPSHOT_HEADER = struct.Struct("<8sQ")  # マジック, スナップショット時点の LSN
+
+
+def encode(event) -> bytes:
+    code, codec = _CODECS[type(event)]
+    body = bytes((code,)) + codec.pack(*event)
+    return _CRC.pack(zlib.crc32(body)) + body
+
+
+def decode(buf, pos: int = 0, end: Optional[int] = None) -> Iterator[tuple[int, tuple]]:
+    """buf の pos から読めるところまでイベントを読み, (次のレコードの位置, イベント) を返す"""
+    if end is None:
+        end = len(buf)
+    decoders = _DECODERS
+    unpack_crc = _CRC.unpack_from
+    crc32 = zlib.crc32
+    while pos + 5 <= end:
+        decoder = decoders.get(buf[pos + 4])
+        if decoder is None:  # 未書き込みの領域
+            return
+        cls, codec = decoder
+        next_pos = pos + 5 + codec.size
+        if next_pos > end or unpack_crc(buf, pos)[0] != crc32(buf[pos + 4 : next_pos]):
+            return  # 書き込み途中でクラッシュしたレコード
+        yield next_pos, cls._make(codec.unpack_from(buf, pos + 5))
+        pos = next_pos
+
+
+# イベントから組み立てるルームの状態
+
+
+@dataclass
+class Member:
+    select_difficulty: int
+    is_host: bool
+    score: Optional[int] = None
+    judge_count_list: Optional[list[int]] = None
+
+
+@dataclass
+class Room:
+    room_id: int
+    live_id: int
+    started: bool = False
+    members: dict[int, Member] = field(default_factory=dict)
+
+
+def apply(rooms: dict[int, Room], event) -> None:
+    """rooms にイベントを適用する, 存在しない部屋・メンバーへのイベントは無視する"""
+    if type(event) is CreateRoom:
+        rooms[event.room_id] = Room(
+            event.room_id,
+            event.live_id,
+            members={event.user_id: Member(event.select_difficulty, True)},
+        )
+        return
+    room = rooms.get(event.room_id)
+    if room is None:
+        return
+    if type(event) is JoinRoom:
+        room.members[event.user_id] = Member(event.select_difficulty, False)
+    elif type(event) is LeaveRoom:
+        room.members.pop(event.user_id, None)
+        if not room.members:  # 最後の一人が抜けたら解散
+            del rooms[event.room_id]
+    elif type(event) is TransferHost:
+        for user_id, member in room.members.items():
+            member.is_host = user_id == event.user_id
+    elif type(event) is StartRoom:
+        room.started = True
+    elif type(event) is EndRoom:
+        member = room.members.get(event.user_id)
+        if member is not None:
+            member.score = event.score
+            member.judge_count_list = list(event[3:])
+
+
+def snapshot_events(rooms: dict[int, Room]) -> Iterator[tuple]:
+    """rooms を再現するイベント列, スナップショットはこの列をそのまま保存する"""
+    for room in rooms.values():
+        members = sorted(room.members.items(), key=lambda item: not item[1].is_host)
+        if not members:
+            continue
+        host_id, host = members[0]
+        yield CreateRoom(room.room_id, room.live_id, host_id, host.select_difficulty)
+        for user_id, member in members[1:]:
+            yield JoinRoom(room.room_id, user_id, member.select_difficulty)
+        if room.started:
+            yield StartRoom(room.room_id)
+        for user_id, member in members:
+            if member.score is not None:
+                yield EndRoom(
+                    room.room_id, user_id, member.score, *member.judge_count_list
+                )
+
+
+# ジャーナル本体
+
+_SCAN_CHUNK = 1024 * 1024  # 末尾の書きかけを探すときに一度に読む大きさ
+
+
+class JournalLocked(Exception):
+    """ジャーナルのディレクトリを他の Journal (別プロセス) が開いているときに投げる"""
+
+
+def _fsync_dir(directory: str) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _data_ranges(fd: int, start: int, end: int) -> Iterator[tuple[int, int]]:
+    """ファイルの start から end までで書き込まれたことのある範囲, 疎なファイルの穴は飛ばす"""
+    while start < end:
+        try:
+            start = os.lseek(fd, start, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # これより後ろは穴だけ
+                return
+            raise
+        if start >= end:
+            return
+        stop = min(os.lseek(fd, start, os.SEEK_HOLE), end)
+        yield start, stop
+        start = stop
+
+
+def _clear_tail(mm: mmap.mmap, fd: int, pos: int) -> None:
+    """pos から後ろに残っているデータ(クラッシュで書きかけになった末尾)を 0 にする
+
+    セグメントは truncate で確保した疎なファイルなので, 通常は pos を含むページだけを読む
+    """
+    dirty = False
+    for start, stop in _data_ranges(fd, pos, len(mm)):
+        for i in range(start, stop, _SCAN_CHUNK):
+            j = min(i + _SCAN_CHUNK, stop)
+            if mm[i:j].count(0) != j - i:
+                mm[i:j] = bytes(j - i)
+                dirty = True
+    if dirty:
+        mm.flush()
+
+
+class Journal:
+    """ルームのイベントを追記するセグメント分割・mmap のログ
+
+    LSN はログ全体でのバイト位置. セグメントのファイル名は先頭の LSN.
+    append(sync=True) は複数スレッドの fsync(msync) を1回にまとめる(グループコミット).
+    スナップショットは追記したスレッドではなく専用のスレッドで取る.
+    ディレクトリは flock で1つの Journal だけが開ける.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = config.JOURNAL_SEGMENT_SIZE,
+        snapshot_every: Optional[int] = config.JOURNAL_SNAPSHOT_EVERY,
+    ):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.snapshot_every = snapshot_every
+        self.rooms: dict[int, Room] = {}
+        self._lock = threading.Lock()  # 追記位置と rooms を守る
+        self._cond = threading.Condition()  # グループコミット
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_needed = threading.Event()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._lock_fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        self._base = 0  # 書き込み中のセグメントの先頭の LSN
+        self._pos = 0  # セグメント内の書き込み位置
+        self._synced = 0  # ディスクに書き出し済みの LSN
+        self._syncing = False
+        self._since_snapshot = 0
+
+    @property
+    def lsn(self) -> int:
+        return self._base + self._pos
+
+    def _path(self, prefix: str, lsn: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{prefix}-{lsn:020d}{suffix}")
+
+    def _list(self, prefix: str, suffix: str) -> list[int]:
+        lsns = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix + "-") and name.endswith(suffix):
+                lsns.append(int(name[len(prefix) + 1 : -len(suffix)]))
+        return sorted(lsns)
+
+    def _segments(self) -> list[int]:
+        return self._list("segment", ".log")
+
+    def _snapshots(self) -> list[int]:
+        return self._list("snapshot", ".bin")
+
+    def open(self) -> None:
+        """最新のスナップショットから後のセグメントを再生して rooms を復元し, 追記できるようにする"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._acquire_lock()
+        snapshot_lsn, self.rooms = self._load_snapshot()
+        rooms = self.rooms
+        segments = self._segments()
+        base, pos = snapshot_lsn, 0
+        for i, segment in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1] <= snapshot_lsn:
+                continue  # スナップショットに含まれるセグメント
+            base, pos = segment, max(snapshot_lsn - segment, 0)
+            with open(self._path("segment", segment, ".log"), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for pos, event in decode(mm, pos):
+                        apply(rooms, event)
+        self._open_segment(base, pos)  # 最後のセグメントの続きから追記する
+        self._synced = self.lsn
+        if self.snapshot_every is not None:
+            self._snapshot_thread = threading.Thread(
+                target=self._run_snapshots, name="journal-snapshot", daemon=True
+            )
+            self._snapshot_thread.start()
+
+    def _acquire_lock(self) -> None:
+        """同じディレクトリに2つの Journal が同じ位置から追記して上書きし合わないようにする"""
+        fd = os.open(
+            os.path.join(self.directory, "journal.lock"), os.O_RDWR | os.O_CREAT
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise JournalLocked(f"{self.directory} is opened by another journal")
+        self._lock_fd = fd
+
+    def _open_segment(self, base: int, pos: int) -> None:
+        path = self._path("segment", base, ".log")
+        created = not os.path.exists(path)
+        with open(path, "a+b") as f:
+            size = max(self.segment_size, os.fstat(f.fileno()).st_size)
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+            if created:
+                os.fsync(f.fileno())
+            else:
+                _clear_tail(mm, f.fileno(), pos)
+        if created:
+            _fsync_dir(self.directory)
+        self._mm, self._base, self._pos = mm, base, pos
+
+    def _roll(self) -> None:
+        """次のセグメントに切り替える, self._lock を持って呼ぶ"""
+        self._mm.flush()  # 古いセグメントはここで書き出し切る
+        self._open_segment(self.lsn, 0)
+
+    def append(self, *events, sync: bool = True) -> int:
+        """イベントを追記して rooms に適用し, 追記後の LSN を返す"""
+        with self._lock:
+            for event in events:
+                record = encode(event)
+                if self._pos + len(record) > len(self._mm):
+                    self._roll()
+                self._mm[self._pos : self._pos + len(record)] = record
+                self._pos += len(record)
+                apply(self.rooms, event)
+            lsn = self.lsn
+            self._since_snapshot += len(events)
+            need_snapshot = (
+                self.snapshot_every is not None
+                and self._since_snapshot >= self.snapshot_every
+            )
+        # 呼び出し元はトランザクションや行ロックを持っているので, ここでは合図だけする
+        if need_snapshot:
+            self._snapshot_needed.set()
+        if sync:
+            self.sync(lsn)
+        return lsn
+
+    def sync(self, lsn: Optional[int] = None) -> None:
+        """lsn までをディスクに書き出す, 書き出し中の他スレッドがいれば相乗りする"""
+        if lsn is None:
+            lsn = self.lsn
+        with self._cond:
+            while self._synced < lsn:
+                if self._syncing:  # 他のスレッドの書き出しを待つ
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                self._cond.release()
+                try:
+                    with self._lock:
+                        target, mm = self.lsn, self._mm
+                    mm.flush()
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._synced = max(self._synced, target)
+
+    def _run_snapshots(self) -> None:
+        while not self._closing:
+            self._snapshot_needed.wait()
+            self._snapshot_needed.clear()
+            if self._since_snapshot >= self.snapshot_every:
+                try:
+                    self.snapshot()
+                except Exception:  # セグメントが残るだけなので次の合図で取り直す
+                    logger.exception("journal snapshot failed")
+
+    def snapshot(self) -> int:
+        """現在の rooms を保存し, 不要になったセグメントを消す. スナップショットの LSN を返す"""
+        with self._snapshot_lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> int:
+        with self._lock:
+            lsn = self.lsn
+            data = b"".join(encode(event) for event in snapshot_events(self.rooms))
+            self._since_snapshot = 0
+        self.sync(lsn)
+        path = self._path("snapshot", lsn, ".bin")
+        with open(path + ".tmp", "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, lsn))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        _fsync_dir(self.directory)
+        for old in self._snapshots():
+            if old < lsn:
+                os.remove(self._path("snapshot", old, ".bin"))
+        segments = self._segments()
+        for segment, next_segment in zip(segments, segments[1:]):
+            if next_segment <= lsn:
+                os.remove(self._path("segment", segment, ".log"))
+        return lsn
+
+    def reset(self, rooms: dict[int, Room]) -> int:
+        """rooms を現在の状態としてスナップショットを取り直す"""
+        with self._snapshot_lock:
+            with self._lock:
+                self.rooms = rooms
+            return self._snapshot()
+
+    def _load_snapshot(self) -> tuple[int, dict[int, Room]]:
+        for lsn in reversed(self._snapshots()):
+            with open(self._path("snapshot", lsn, ".bin"), "rb") as f:
+                data = f.read()
+            magic, header_lsn = _SNAPSHOT_HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC or header_lsn != lsn:
+                continue
+            rooms: dict[int, Room] = {}
+            pos = _SNAPSHOT_HEADER.size
+            for pos, event in decode(data, pos):
+                apply(rooms, event)
+            if pos == len(data):  # 最後まで読めたものだけ使う
+                return lsn, rooms
+        return 0, {}
+
+    def close(self) -> None:
+        if self._snapshot_thread is not None:
+            self._closing = True
+            self._snapshot_needed.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        if self._mm is not None:
+            self.sync()
+            self._mm.close()
+            self._mm = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # flock も外れる
+            self._lock_fd = None
+
+
+# 復元したルームの状態(room_journal.rooms)はまだ読み取りには使っていない.
+# ルームの状態をプロセス内に持つようになった時に再起動後の状態として使う
+room_journal: Optional[Journal] = None
+
+
+def open_journal(load_rooms: Optional[Callable[[], dict[int, Room]]] = None) -> None:
+    """config.JOURNAL_DIR が設定されていればジャーナルを開いてルームの状態を復元する
+
+    load_rooms を渡すと DB の状態と突き合わせ, 食い違っていれば DB の状態で取り直す
+    """
+    global room_journal
+    if not config.JOURNAL_DIR or room_journal is not None:
+        return
+    opened = Journal(config.JOURNAL_DIR)
+    opened.open()  # 他のプロセスが開いていれば JournalLocked で起動に失敗する
+    room_journal = opened
+    if load_rooms is None:
+        return
+    rooms = load_rooms()
+    if rooms != room_journal.rooms:
+        logger.warning(
+            "journal does not match the database (%d rooms vs %d), re-seeding",
+            len(room_journal.rooms),
+            len(rooms),
+        )
+        room_journal.reset(rooms)
+
+
+def close_journal() -> None:
+    global room_journal
+    if room_journal is not None:
+        room_journal.close()
+        room_journal = None
+
+
+def record(*events) -> None:
+    """ジャーナルが開かれていればイベントを記録してディスクへの書き出しを待つ"""
+    if room_journal is not None:
+        room_journal.append(*events)
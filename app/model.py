@@ -1,4 +1,5 @@
 import json
+import time
 import uuid
 from enum import Enum, IntEnum
 from typing import Optional
@@ -8,10 +9,35 @@ from pydantic import BaseModel
 from sqlalchemy import text
 from sqlalchemy.exc import NoResultFound
 
-from .db import engine
+from . import journal
+from .db import engine, replicas
 
 max_user_count = 4  # 部屋の最大人数
 
+# token -> 最後に書き込んだ時刻. プロセス内の記録なので read-your-writes が保証されるのは
+# 同じプロセスに来た読み取りだけ(uvicorn のワーカー1つ前提, config.REPLICA_STICKY_SECONDS 参照)
+_last_write: dict[str, float] = {}
+
+
+def _mark_write(token: str) -> None:
+    """書き込んだユーザーの読み取りをしばらく primary に送る(read-your-writes)
+
+    コミットの後に呼ぶ, 前に呼ぶとロック待ちの間に期間が切れてしまう
+    """
+    now = time.monotonic()
+    _last_write[token] = now
+    if len(_last_write) > 10000:  # レプリカに届いているはずの古い記録を捨てる
+        expire = now - max(replicas.sticky_seconds, replicas.max_lag)
+        for key, written in list(_last_write.items()):
+            if written < expire:
+                _last_write.pop(key, None)
+
+
+def _read_engine(token: Optional[str] = None):
+    """読み取り用の engine, token のユーザーが直前に書き込んでいれば primary"""
+    written = _last_write.get(token) if token is not None else None
+    return replicas.engine_for(None if written is None else time.monotonic() - written)
+
 
 class InvalidToken(Exception):
     """指定されたtokenが不正だったときに投げる"""
@@ -44,10 +70,12 @@ def create_user(name: str, leader_card_id: int) -> str:
                 ),
                 {"name": name, "token": token, "leader_card_id": leader_card_id},
             )
+        _mark_write(token)
         return token
 
 
 def _get_user_by_token(conn, token: str) -> Optional[SafeUser]:
+    """書き込み中は同じ conn(primary) で引く, レプリカはまだユーザーを知らないことがある"""
     result = conn.execute(
         text("SELECT `id`, `name`, `leader_card_id` FROM `user` WHERE `token`=:token"),
         dict(token=token),
@@ -60,7 +88,7 @@ def _get_user_by_token(conn, token: str) -> Optional[SafeUser]:
 
 
 def get_user_by_token(token: str) -> Optional[SafeUser]:
-    with engine.begin() as conn:
+    with _read_engine(token).begin() as conn:
         return _get_user_by_token(conn, token)
 
 
@@ -72,6 +100,7 @@ def update_user(token: str, name: str, leader_card_id: int) -> None:
             ),
             dict(token=token, name=name, leader_card_id=leader_card_id),
         )
+    _mark_write(token)
 
 
 class LiveDifficulty(IntEnum):
@@ -115,8 +144,8 @@ class ResultUser(BaseModel):
 
 
 def create_room(token: str, live_id: int, select_difficulty: int) -> int:
-    user_id = get_user_by_token(token).id  # ホストのユーザidを取得
     with engine.begin() as conn:
+        user_id = _get_user_by_token(conn, token).id  # ホストのユーザidを取得
         result = conn.execute(  # 部屋の生成
             text("INSERT INTO `room` (`live_id`) VALUES (:live_id)"),
             dict(live_id=live_id),
@@ -128,11 +157,14 @@ def create_room(token: str, live_id: int, select_difficulty: int) -> int:
             ),
             dict(user_id=user_id, room_id=room_id, select_difficulty=select_difficulty),
         )
-        return room_id
+        # コミット前に記録する, 記録に失敗したら書き込みもロールバックされる
+        journal.record(journal.CreateRoom(room_id, live_id, user_id, select_difficulty))
+    _mark_write(token)
+    return room_id
 
 
 def get_room_info(live_id: int) -> list[RoomInfo]:
-    with engine.begin() as conn:
+    with _read_engine().begin() as conn:
         if live_id == 0:  # live_id = 0のとき全てのルームを対象とする
             result = conn.execute(
                 text("SELECT `room_id`, `live_id`, `start` FROM `room`")
@@ -168,8 +200,8 @@ def get_room_info(live_id: int) -> list[RoomInfo]:
 
 
 def join_room(token: str, room_id: int, select_difficulty: int) -> int:
-    user_id = get_user_by_token(token).id  # joinするユーザのidを取得
     with engine.begin() as conn:
+        user_id = _get_user_by_token(conn, token).id  # joinするユーザのidを取得
         result = conn.execute(  # 現在の人数を確認
             text(
                 "SELECT COUNT(`id`) FROM `room_member` WHERE `room_id`=:room_id FOR UPDATE"
@@ -181,22 +213,23 @@ def join_room(token: str, room_id: int, select_difficulty: int) -> int:
             return 2
         elif joined_user_count == 0:  # 既に解散済み
             return 3
-        else:
-            conn.execute(
-                text(
-                    "INSERT INTO `room_member` (`id`, `room_id`, `select_difficulty`) VALUES (:user_id, :room_id, :select_difficulty)"
-                ),
-                dict(
-                    user_id=user_id,
-                    room_id=room_id,
-                    select_difficulty=select_difficulty,
-                ),
-            )
-            return 1
+        conn.execute(
+            text(
+                "INSERT INTO `room_member` (`id`, `room_id`, `select_difficulty`) VALUES (:user_id, :room_id, :select_difficulty)"
+            ),
+            dict(
+                user_id=user_id,
+                room_id=room_id,
+                select_difficulty=select_difficulty,
+            ),
+        )
+        journal.record(journal.JoinRoom(room_id, user_id, select_difficulty))
+    _mark_write(token)
+    return 1
 
 
 def wait_room(token: str, room_id: int) -> list[WaitRoomStatus, list[RoomUser]]:
-    with engine.begin() as conn:
+    with _read_engine(token).begin() as conn:
         result = conn.execute(
             text("SELECT `start` FROM `room` WHERE `room_id`=:room_id"),
             dict(room_id=room_id),
@@ -240,11 +273,13 @@ def start_room(token: str, room_id: int) -> None:
             text("UPDATE `room` SET `start`=1 WHERE `room_id`=:room_id"),
             dict(room_id=room_id),
         )
+        journal.record(journal.StartRoom(room_id))
+    _mark_write(token)
 
 
 def end_room(token: str, room_id: int, judge_count_list: list[int], score: int) -> None:
-    user_id = get_user_by_token(token).id  # endするユーザのidを取得
     with engine.begin() as conn:
+        user_id = _get_user_by_token(conn, token).id  # endするユーザのidを取得
         result = conn.execute(
             text(
                 "UPDATE `room_member` SET `score`=:score, `perfect`=:perfect, `great`=:great, `good`=:good, `bad`=:bad, `miss`=:miss WHERE `id`=:user_id"
@@ -259,11 +294,30 @@ def end_room(token: str, room_id: int, judge_count_list: list[int], score: int)
                 miss=judge_count_list[4],
             ),
         )
+        # エクスポート用に結果を残す, room_member の行は結果の取得後に消える. 再送されたら上書き
+        conn.execute(
+            text(
+                "INSERT INTO `play_result` (`user_id`, `room_id`, `live_id`, `select_difficulty`, `score`, `perfect`, `great`, `good`, `bad`, `miss`) SELECT `room_member`.`id`, `room`.`room_id`, `room`.`live_id`, `room_member`.`select_difficulty`, :score, :perfect, :great, :good, :bad, :miss FROM `room_member` JOIN `room` ON `room`.`room_id`=`room_member`.`room_id` WHERE `room_member`.`id`=:user_id AND `room_member`.`room_id`=:room_id ON DUPLICATE KEY UPDATE `score`=:score, `perfect`=:perfect, `great`=:great, `good`=:good, `bad`=:bad, `miss`=:miss"
+            ),
+            dict(
+                score=score,
+                user_id=user_id,
+                room_id=room_id,
+                perfect=judge_count_list[0],
+                great=judge_count_list[1],
+                good=judge_count_list[2],
+                bad=judge_count_list[3],
+                miss=judge_count_list[4],
+            ),
+        )
+        journal.record(journal.EndRoom(room_id, user_id, score, *judge_count_list[:5]))
+    _mark_write(token)
 
 
 def leave_room(token: str, room_id: int) -> None:
-    user_id = get_user_by_token(token).id  # leaveするユーザのidを取得
+    events = []
     with engine.begin() as conn:
+        user_id = _get_user_by_token(conn, token).id  # leaveするユーザのidを取得
         result = conn.execute(
             text("SELECT `id`, `is_host` FROM `room_member` WHERE `room_id`=:room_id"),
             dict(room_id=room_id),
@@ -287,16 +341,20 @@ def leave_room(token: str, room_id: int) -> None:
                                 ),
                                 dict(id=member2.id),
                             )
+                            events.append(journal.TransferHost(room_id, member2.id))
                             break
                     break
         result = conn.execute(  # ユーザーをルームから削除
             text("DELETE FROM `room_member` WHERE `id`=:id"),
             dict(id=user_id),
         )
+        events.append(journal.LeaveRoom(room_id, user_id))
+        journal.record(*events)
+    _mark_write(token)
 
 
 def get_result(token: str, room_id: int) -> list[ResultUser]:
-    with engine.begin() as conn:
+    with _read_engine(token).begin() as conn:
         result = conn.execute(
             text(
                 "SELECT `id`, `score`, `perfect`, `great`, `good`, `bad`, `miss` FROM `room_member` WHERE `room_id`=:room_id"
@@ -323,5 +381,42 @@ def get_result(token: str, room_id: int) -> list[ResultUser]:
                     score=member.score,
                 )
             )
-        leave_room(token, room_id)  # 結果を受け取ったら部屋から退出 → 部屋も自動的に削除
-        return list_result_user
+    leave_room(token, room_id)  # 結果を受け取ったら部屋から退出 → 部屋も自動的に削除
+    return list_result_user
+
+
+def load_rooms() -> dict[int, journal.Room]:
+    """DB のルームの状態をジャーナルの形式で読む, 起動時の突き合わせに使う"""
+    with engine.begin() as conn:
+        result = conn.execute(text("SELECT `room_id`, `live_id`, `start` FROM `room`"))
+        rooms = {
+            row.room_id: journal.Room(row.room_id, row.live_id, bool(row.start))
+            for row in result.all()
+        }
+        result = conn.execute(
+            text(
+                "SELECT `id`, `room_id`, `select_difficulty`, `is_host`, `score`, `perfect`, `great`, `good`, `bad`, `miss` FROM `room_member`"
+            )
+        )
+        for member in result.all():
+            room = rooms.get(member.room_id)
+            if room is None:
+                continue
+            room.members[member.id] = journal.Member(
+                member.select_difficulty,
+                bool(member.is_host),
+                member.score,
+                (
+                    None
+                    if member.score is None
+                    else [
+                        member.perfect,
+                        member.great,
+                        member.good,
+                        member.bad,
+                        member.miss,
+                    ]
+                ),
+            )
+    # ジャーナルでは最後の一人が抜けた部屋は消える
+    return {room_id: room for room_id, room in rooms.items() if room.members}
@@ -0,0 +1,143 @@
+from contextvars import ContextVar
+from typing import Any, Callable, Mapping, Optional
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from fastapi.utils import is_body_allowed_for_status_code
+from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException
+
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = {MSGPACK, "application/x-msgpack"}
+JSON_TYPES = {"application/json", "application/*", "*/*"}  # JSON を返して良い指定
+
+# 処理中のリクエストが MessagePack のレスポンスを求めているか
+_wants_msgpack: ContextVar[bool] = ContextVar("wants_msgpack", default=False)
+
+
+def _media_type(value: str) -> str:
+    return value.split(";", 1)[0].strip().lower()
+
+
+def _quality(params: list[str]) -> float:
+    for param in params:
+        key, _, value = param.strip().partition("=")
+        if key.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def accepts_msgpack(accept: str) -> bool:
+    """Accept ヘッダーで MessagePack が JSON より優先されているか, 同じ優先度なら JSON"""
+    msgpack_q = json_q = 0.0
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        media_type = media_type.strip().lower()
+        if media_type in MSGPACK_TYPES:
+            msgpack_q = max(msgpack_q, _quality(params))
+        elif media_type in JSON_TYPES:
+            json_q = max(json_q, _quality(params))
+    return msgpack_q > json_q
+
+
+class MsgPackRequest(Request):
+    """MessagePack のボディを JSON のボディとして FastAPI に渡す"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+def _as_json_request(request: Request) -> MsgPackRequest:
+    # FastAPI は Content-Type が JSON の時だけ json() でボディを読むので書き換える
+    headers = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+    headers.append((b"content-type", b"application/json"))
+    return MsgPackRequest({**request.scope, "headers": headers}, request.receive)
+
+
+class NegotiatedResponse(JSONResponse):
+    """Accept に応じて JSON か MessagePack でエンコードするレスポンス, 既定は JSON"""
+
+    # FastAPI は OpenAPI の生成で status_code の既定値を読むので親と同じシグネチャにする
+    def __init__(
+        self,
+        content: Any,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        if media_type is None and _wants_msgpack.get():
+            media_type = MSGPACK
+        super().__init__(content, status_code, headers, media_type, background)
+        self.headers["Vary"] = "Accept"
+
+    def render(self, content: Any) -> bytes:
+        if self.media_type == MSGPACK:
+            return msgpack.packb(content)
+        return super().render(content)
+
+
+class MsgPackRoute(APIRoute):
+    """Content-Type / Accept が application/msgpack のリクエストを扱うルート"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            if _media_type(request.headers.get("content-type", "")) in MSGPACK_TYPES:
+                request = _as_json_request(request)
+            token = _wants_msgpack.set(
+                accepts_msgpack(request.headers.get("accept", ""))
+            )
+            try:
+                return await handler(request)
+            finally:
+                _wants_msgpack.reset(token)
+
+        return negotiated_handler
+
+
+# 例外ハンドラはルートの外で動くので Accept を自分で見る
+
+
+def _negotiated_error(
+    request: Request,
+    content: Any,
+    status_code: int,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    if accepts_msgpack(request.headers.get("accept", "")):
+        media_type = MSGPACK
+    else:
+        media_type = JSONResponse.media_type
+    return NegotiatedResponse(content, status_code, headers, media_type)
+
+
+async def http_exception_handler(request: Request, exc: HTTPException) -> Response:
+    """FastAPI 既定のハンドラと同じ内容を Accept に応じた形式で返す"""
+    if not is_body_allowed_for_status_code(exc.status_code):
+        return Response(status_code=exc.status_code, headers=exc.headers)
+    return _negotiated_error(
+        request, {"detail": exc.detail}, exc.status_code, exc.headers
+    )
+
+
+async def validation_exception_handler(
+    request: Request, exc: RequestValidationError
+) -> Response:
+    return _negotiated_error(request, {"detail": jsonable_encoder(exc.errors())}, 422)
+
+
+exception_handlers = {
+    HTTPException: http_exception_handler,
+    RequestValidationError: validation_exception_handler,
+}
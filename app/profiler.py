@@ -0,0 +1,206 @@
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from . import config
+from .auth import is_capture_key
+
+# 値に PROFILE_CAPTURE_KEY を入れるとそのリクエストをフルプロファイル
+CAPTURE_HEADER = "X-Profile-Capture"
+CAPTURE_ID_HEADER = "X-Profile-Id"  # フルプロファイルの取得に使うID
+
+# 処理中のリクエストのプロファイル対象 (ルート, キャプチャID)
+_current: ContextVar[Optional[tuple[str, Optional[str]]]] = ContextVar(
+    "profile_target", default=None
+)
+
+
+class Profiler:
+    """ルートごとにスタックを集計するサンプリングプロファイラ
+
+    無効時はリクエストごとに enabled を見るだけでスレッドも動かさない.
+    採取は GIL を取れた時なので, DB 待ちなどの I/O は見えるが短い CPU 処理は取りこぼしやすい
+    """
+
+    def __init__(self, sample_rate: float, interval: float, max_captures: int):
+        self.enabled = False
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_captures = max_captures
+        self._lock = threading.Lock()
+        # スレッドID -> (ルート, 根のフレーム)
+        self._targets: dict[int, tuple[str, object]] = {}
+        # ルート -> 折りたたみスタック -> サンプル数
+        self._stacks: dict[str, Counter] = {}
+        self._captures: OrderedDict[str, str] = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, enabled: bool, sample_rate: Optional[float] = None) -> None:
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            self.enabled = enabled
+            if enabled and self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="profiler", daemon=True
+                )
+                self._thread.start()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self._captures.clear()
+
+    def should_sample(self) -> bool:
+        return random.random() < self.sample_rate
+
+    def track(self, route: str, endpoint: Callable, /, *args, **kwargs):
+        """サンプラーの対象に登録してエンドポイントを呼ぶ
+
+        エンドポイントの引数と名前が衝突しないように route, endpoint は位置専用
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._targets[thread_id] = (route, sys._getframe())
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            with self._lock:
+                del self._targets[thread_id]
+
+    def capture(self, capture_id: str, endpoint: Callable, /, *args, **kwargs):
+        """cProfile でエンドポイントの呼び出しを丸ごと計測する"""
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(endpoint, *args, **kwargs)
+        finally:
+            out = io.StringIO()
+            stats = pstats.Stats(profile, stream=out)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats()
+            with self._lock:
+                self._captures[capture_id] = out.getvalue()
+                while len(self._captures) > self.max_captures:  # 古いものから捨てる
+                    self._captures.popitem(last=False)
+
+    def get_capture(self, capture_id: str) -> Optional[str]:
+        with self._lock:
+            return self._captures.get(capture_id)
+
+    def routes(self) -> dict[str, int]:
+        """ルートごとの総サンプル数"""
+        with self._lock:
+            return {route: sum(c.values()) for route, c in self._stacks.items()}
+
+    def collapsed(self, route: Optional[str] = None) -> str:
+        """flamegraph.pl / speedscope で読める折りたたみスタック形式"""
+        with self._lock:
+            items = [
+                (r, c.copy())
+                for r, c in self._stacks.items()
+                if route is None or r == route
+            ]
+        lines = []
+        for r, stacks in items:
+            for stack, count in stacks.items():
+                lines.append(f"{r};{stack} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self.enabled:  # 無効化されたらスレッドを終了する
+                    self._thread = None
+                    return
+                targets = dict(self._targets)
+            if targets:
+                frames = sys._current_frames()
+                samples = []
+                for thread_id, (route, root) in targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples.append((route, _collapse(frame, root)))
+                with self._lock:
+                    for route, stack in samples:
+                        self._stacks.setdefault(route, Counter())[stack] += 1
+            time.sleep(self.interval)
+
+
+def _collapse(frame, root) -> str:
+    """root (track のフレーム) より上のフレームを根から順に ; で繋ぐ"""
+    names = []
+    while frame is not None and frame is not root:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+profiler = Profiler(
+    config.PROFILE_SAMPLE_RATE, config.PROFILE_INTERVAL, config.PROFILE_MAX_CAPTURES
+)
+
+
+def _wrap_endpoint(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        target = _current.get()
+        if target is None:
+            return endpoint(*args, **kwargs)
+        route, capture_id = target
+        if capture_id is not None:
+            return profiler.capture(capture_id, endpoint, *args, **kwargs)
+        return profiler.track(route, endpoint, *args, **kwargs)
+
+    return wrapper
+
+
+class ProfilingRoute(APIRoute):
+    """プロファイラが有効な時に一部のリクエストを, ヘッダー指定があれば常に計測するルート
+
+    同期エンドポイントはスレッドプールで実行されるので, そのスレッドでの呼び出しを包む
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _wrap_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def profiled_handler(request: Request) -> Response:
+            capture_id = None
+            capture = request.headers.get(CAPTURE_HEADER)
+            # ヘッダー指定はサンプリングの有効無効に関係なく計測する
+            if capture and is_capture_key(capture):
+                capture_id = uuid.uuid4().hex
+            elif not profiler.enabled or not profiler.should_sample():
+                return await handler(request)
+            token = _current.set((route, capture_id))
+            try:
+                response = await handler(request)
+            finally:
+                _current.reset(token)
+            if capture_id is not None:
+                response.headers[CAPTURE_ID_HEADER] = capture_id
+            return response
+
+        return profiled_handler
@@ -0,0 +1,111 @@
+"""ルームのイベントジャーナルの追記スループットと復元時間
+
+python -m bench.bench_journal
+"""
+
+import itertools
+import tempfile
+import threading
+import time
+
+from app.journal import (
+    CreateRoom,
+    EndRoom,
+    JoinRoom,
+    Journal,
+    LeaveRoom,
+    StartRoom,
+    TransferHost,
+)
+
+N_EVENTS = 1000000
+LOBBY_EVERY = 7  # この数の部屋に1つは開始せずロビーに残す(100万イベントで約1万部屋)
+
+
+def room_events(room_id: int):
+    """4人部屋の作成から解散までの15イベント, ロビーに残る部屋は集まるまでの4イベント"""
+    host = room_id * 4
+    members = [host + i for i in range(4)]
+    yield CreateRoom(room_id, 1001, host, 1)
+    for user_id in members[1:]:
+        yield JoinRoom(room_id, user_id, 2)
+    if room_id % LOBBY_EVERY == 0:
+        return
+    yield StartRoom(room_id)
+    for user_id in members:
+        yield EndRoom(room_id, user_id, 1234, 4, 3, 2, 1, 3)
+    yield TransferHost(room_id, members[1])
+    for user_id in members:
+        yield LeaveRoom(room_id, user_id)
+
+
+def events(n: int):
+    all_events = itertools.chain.from_iterable(
+        room_events(room_id) for room_id in itertools.count(1)
+    )
+    return list(itertools.islice(all_events, n))
+
+
+def bench_append(directory: str, batch: list) -> None:
+    journal = Journal(directory, snapshot_every=None)
+    journal.open()
+    start = time.perf_counter()
+    for event in batch:
+        journal.append(event, sync=False)
+    journal.sync()
+    elapsed = time.perf_counter() - start
+    print(
+        f"append (1 sync): {len(batch)} events in {elapsed:.2f} s"
+        f" = {len(batch) / elapsed:,.0f} events/s, {journal.lsn / 2**20:.1f} MiB"
+    )
+    journal.close()
+
+
+def bench_group_commit(directory: str, batch: list, n_threads: int) -> None:
+    journal = Journal(directory, snapshot_every=None)
+    journal.open()
+    chunks = [batch[i::n_threads] for i in range(n_threads)]
+
+    def worker(chunk):
+        for event in chunk:
+            journal.append(event)  # 1イベントごとにディスクへの書き出しを待つ
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(
+        f"append (sync each, {n_threads} threads): {len(batch)} events in"
+        f" {elapsed:.2f} s = {len(batch) / elapsed:,.0f} events/s"
+    )
+    journal.close()
+
+
+def bench_recovery(directory: str, snapshot: bool) -> None:
+    if snapshot:
+        journal = Journal(directory, snapshot_every=None)
+        journal.open()
+        journal.snapshot()
+        journal.close()
+    journal = Journal(directory, snapshot_every=None)
+    start = time.perf_counter()
+    journal.open()
+    elapsed = time.perf_counter() - start
+    label = "from snapshot" if snapshot else "full replay"
+    print(f"recovery ({label}): {elapsed:.2f} s, {len(journal.rooms)} rooms")
+    journal.close()
+
+
+if __name__ == "__main__":
+    batch = events(N_EVENTS)
+    with tempfile.TemporaryDirectory() as directory:
+        bench_append(directory, batch)
+        bench_recovery(directory, snapshot=False)
+        bench_recovery(directory, snapshot=True)
+    with tempfile.TemporaryDirectory() as directory:
+        bench_group_commit(directory, batch[:20000], n_threads=1)
+    with tempfile.TemporaryDirectory() as directory:
+        bench_group_commit(directory, batch[:20000], n_threads=16)
@@ -0,0 +1,74 @@
+"""JSON と MessagePack のペイロードサイズ・エンコード/デコード時間の比較
+
+python -m bench.bench_msgpack
+"""
+
+import json
+import timeit
+
+import msgpack
+from fastapi.encoders import jsonable_encoder
+
+from app.model import LiveDifficulty, RoomInfo, RoomUser, max_user_count
+
+
+def _json_dumps(content) -> bytes:  # JSONResponse.render と同じ設定
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def room_wait_payload() -> dict:
+    """4人部屋の /room/wait のレスポンス"""
+    room_user_list = [
+        RoomUser(
+            user_id=100000 + i,
+            name=f"room_user_{i}",
+            leader_card_id=1000 + i,
+            select_difficulty=LiveDifficulty.normal,
+            is_me=i == 0,
+            is_host=i == 0,
+        )
+        for i in range(max_user_count)
+    ]
+    return jsonable_encoder({"status": 1, "room_user_list": room_user_list})
+
+
+def room_list_payload(n: int = 1000) -> dict:
+    """n 部屋分の /room/list のレスポンス"""
+    room_info_list = [
+        RoomInfo(
+            room_id=100000 + i,
+            live_id=1000 + i % 7,
+            joined_user_count=1 + i % 3,
+            max_user_count=max_user_count,
+        )
+        for i in range(n)
+    ]
+    return jsonable_encoder({"room_info_list": room_info_list})
+
+
+def bench(name: str, content: dict, number: int) -> None:
+    json_body = _json_dumps(content)
+    msgpack_body = msgpack.packb(content)
+    assert json.loads(json_body) == msgpack.unpackb(msgpack_body)
+    results = {
+        "json encode": timeit.timeit(lambda: _json_dumps(content), number=number),
+        "json decode": timeit.timeit(lambda: json.loads(json_body), number=number),
+        "msgpack encode": timeit.timeit(lambda: msgpack.packb(content), number=number),
+        "msgpack decode": timeit.timeit(
+            lambda: msgpack.unpackb(msgpack_body), number=number
+        ),
+    }
+    print(f"## {name}")
+    print(
+        f"size: json {len(json_body)} B, msgpack {len(msgpack_body)} B"
+        f" ({len(msgpack_body) / len(json_body):.0%})"
+    )
+    for label, elapsed in results.items():
+        print(f"{label}: {elapsed / number * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    bench("room/wait (4 members)", room_wait_payload(), number=100000)
+    bench("room/list (1000 rooms)", room_list_payload(), number=1000)
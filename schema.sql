@@ -28,4 +28,23 @@ CREATE TABLE `room_member` (
   `bad` int, -- 各判定数(bad)
   `miss` int, -- 各判定数(miss)
   PRIMARY KEY (`room_id`, `id`)
-);
\ No newline at end of file
+);
+
+DROP TABLE IF EXISTS `play_result`;
+CREATE TABLE `play_result` (
+  `id` bigint NOT NULL AUTO_INCREMENT PRIMARY KEY, -- 結果ID
+  `user_id` bigint NOT NULL, -- ユーザーID
+  `room_id` bigint NOT NULL, -- ルームID
+  `live_id` bigint NOT NULL, -- ライブID
+  `select_difficulty` int NOT NULL, -- 選択難易度
+  `score` bigint NOT NULL, -- スコア
+  `perfect` int NOT NULL, -- 各判定数(perfect)
+  `great` int NOT NULL, -- 各判定数(great)
+  `good` int NOT NULL, -- 各判定数(good)
+  `bad` int NOT NULL, -- 各判定数(bad)
+  `miss` int NOT NULL, -- 各判定数(miss)
+  `created_at` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6), -- ライブ終了時刻
+  UNIQUE KEY (`room_id`, `user_id`), -- /room/end のリトライで重複させない
+  INDEX (`live_id`, `created_at`),
+  INDEX (`created_at`)
+);
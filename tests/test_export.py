@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import config, export
+from app.api import app
+
+client = TestClient(app)
+live_id = 1900
+
+
+@pytest.fixture
+def admin_header(monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "test_admin_token")
+    return {"X-Admin-Token": "test_admin_token"}
+
+
+def _play():
+    """1人で部屋を立ててライブを終える"""
+    response = client.post(
+        "/user/create", json={"user_name": "export", "leader_card_id": 1000}
+    )
+    headers = {"Authorization": f"bearer {response.json()['user_token']}"}
+    response = client.post(
+        "/room/create",
+        headers=headers,
+        json={"live_id": live_id, "select_difficulty": 2},
+    )
+    room_id = response.json()["room_id"]
+    client.post("/room/start", headers=headers, json={"room_id": room_id})
+    for _ in range(2):  # /room/end のリトライ
+        client.post(
+            "/room/end",
+            headers=headers,
+            json={
+                "room_id": room_id,
+                "score": 4321,
+                "judge_count_list": [5, 4, 3, 2, 1],
+            },
+        )
+    client.post("/room/result", headers=headers, json={"room_id": room_id})
+    return room_id
+
+
+def _chunks():
+    """iter_results の代わりの2チャンク"""
+    created_at = datetime(2026, 10, 1, 12, 34, 56, 789000)
+    yield [(1, 10, 100, 1001, 1, 4321, 5, 4, 3, 2, 1, created_at)]
+    yield [
+        (2, 11, 100, 1001, 2, 1234, 1, 2, 3, 4, 5, created_at),
+        (3, 12, 101, 1002, 3, 0, 0, 0, 0, 0, 9, created_at),
+    ]
+
+
+def test_export_requires_admin(admin_header):
+    response = client.get("/export/results")
+    assert response.status_code == 403
+
+    response = client.get(  # parquet は CLI のみ
+        "/export/results", headers=admin_header, params={"format": "parquet"}
+    )
+    assert response.status_code == 400
+
+
+def test_export_formats(tmp_path):
+    rows = [
+        json.loads(line) for line in "".join(export.to_ndjson(_chunks())).splitlines()
+    ]
+    assert [row["id"] for row in rows] == [1, 2, 3]
+    assert rows[0]["score"] == 4321
+    assert rows[0]["created_at"] == "2026-10-01T12:34:56.789000"
+
+    text = "".join(export.to_csv(_chunks()))
+    assert list(csv.DictReader(io.StringIO(text))) == [
+        {k: str(v) for k, v in row.items()} for row in rows
+    ]
+    assert "".join(export.to_csv(iter([]))) == ",".join(export.COLUMNS) + "\r\n"
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "results.parquet")
+    export.write_parquet(_chunks(), path)
+    parquet = pq.ParquetFile(path)
+    assert parquet.num_row_groups == 2  # チャンクごと
+    assert parquet.read().to_pylist() == [
+        {**row, "created_at": datetime.fromisoformat(row["created_at"])} for row in rows
+    ]
+
+
+def test_export_cli(tmp_path, monkeypatch, capsys):
+    calls = []
+
+    def iter_results(live_id, since, until, chunk_size):
+        calls.append((live_id, since, until, chunk_size))
+        return _chunks()
+
+    monkeypatch.setattr(export, "iter_results", iter_results)
+    export.main(["--live-id", "1001", "--since", "2026-10-01", "--chunk-size", "2"])
+    assert calls == [(1001, datetime(2026, 10, 1), None, 2)]
+    assert len(capsys.readouterr().out.splitlines()) == 3
+
+    path = tmp_path / "results.csv"
+    export.main(["--format", "csv", "-o", str(path)])
+    assert len(list(csv.DictReader(io.StringIO(path.read_text())))) == 3
+
+    with pytest.raises(SystemExit):  # parquet は標準出力に書けない
+        export.main(["--format", "parquet"])
+
+
+def test_export_results(admin_header):
+    room_id = _play()  # 結果を受け取って room_member から消えた後もエクスポートできる
+
+    response = client.get(
+        "/export/results", headers=admin_header, params={"live_id": live_id}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    room_rows = [row for row in rows if row["room_id"] == room_id]
+    assert len(room_rows) == 1  # リトライしても1行
+    row = room_rows[0]
+    assert row["live_id"] == live_id
+    assert row["select_difficulty"] == 2
+    assert row["score"] == 4321
+    assert [row[k] for k in ["perfect", "great", "good", "bad", "miss"]] == [
+        5,
+        4,
+        3,
+        2,
+        1,
+    ]
+
+    response = client.get(
+        "/export/results",
+        headers=admin_header,
+        params={"format": "csv", "live_id": live_id},
+    )
+    assert response.status_code == 200
+    assert len(list(csv.DictReader(io.StringIO(response.text)))) == len(rows)
+
+    response = client.get(  # 範囲外
+        "/export/results",
+        headers=admin_header,
+        params={"live_id": live_id, "until": "2000-01-01T00:00:00"},
+    )
+    assert response.status_code == 200
+    assert response.text == ""
@@ -0,0 +1,196 @@
+import os
+import threading
+
+import pytest
+
+from app import config, journal
+from app.journal import (
+    CreateRoom,
+    EndRoom,
+    JoinRoom,
+    Journal,
+    JournalLocked,
+    LeaveRoom,
+    StartRoom,
+    TransferHost,
+    apply,
+    decode,
+    encode,
+)
+
+
+def _room_events(room_id):
+    """部屋の作成から全員の退出までのイベント"""
+    yield CreateRoom(room_id, 1001, 1, 1)
+    for user_id in [2, 3, 4]:
+        yield JoinRoom(room_id, user_id, 2)
+    yield TransferHost(room_id, 2)
+    yield LeaveRoom(room_id, 1)
+    yield StartRoom(room_id)
+    for user_id in [2, 3, 4]:
+        yield EndRoom(room_id, user_id, 1234, 4, 3, 2, 1, 3)
+    for user_id in [2, 3, 4]:
+        yield LeaveRoom(room_id, user_id)
+
+
+def test_encode_decode():
+    events = list(_room_events(1))
+    buf = b"".join(encode(event) for event in events)
+    assert [event for _, event in decode(buf)] == events
+
+    assert [event for _, event in decode(buf[:-1])] == events[:-1]  # 書きかけのレコード
+
+    broken = bytearray(buf)
+    broken[len(encode(events[0])) + 6] ^= 0xFF  # 2番目のレコードを壊す
+    assert [event for _, event in decode(bytes(broken))] == events[:1]
+
+
+def test_recovery(tmp_path):
+    journal = Journal(str(tmp_path), segment_size=4096, snapshot_every=None)
+    journal.open()
+    for room_id in range(1, 100):
+        journal.append(*_room_events(room_id), sync=False)
+    journal.append(CreateRoom(100, 1002, 10, 1), JoinRoom(100, 11, 2))
+    journal.append(TransferHost(100, 11), LeaveRoom(100, 10), StartRoom(100))
+    journal.append(EndRoom(100, 11, 5000, 10, 0, 0, 0, 0))
+    lsn = journal.lsn
+    journal.close()
+    assert len(os.listdir(tmp_path)) > 1  # セグメントが分かれている
+
+    journal = Journal(str(tmp_path), segment_size=4096, snapshot_every=None)
+    journal.open()
+    assert journal.lsn == lsn
+    assert list(journal.rooms) == [100]
+    room = journal.rooms[100]
+    assert room.live_id == 1002
+    assert room.started
+    assert list(room.members) == [11]
+    assert room.members[11].is_host
+    assert room.members[11].score == 5000
+    assert room.members[11].judge_count_list == [10, 0, 0, 0, 0]
+
+    journal.append(JoinRoom(100, 12, 1))  # 復元後も続きから追記できる
+    journal.close()
+    journal = Journal(str(tmp_path), segment_size=4096, snapshot_every=None)
+    journal.open()
+    assert list(journal.rooms[100].members) == [11, 12]
+    journal.close()
+
+
+def test_snapshot(tmp_path):
+    journal = Journal(str(tmp_path), segment_size=4096, snapshot_every=500)
+    journal.open()
+    for room_id in range(1, 200):
+        journal.append(*_room_events(room_id), sync=False)
+        journal.append(CreateRoom(1000 + room_id, 1001, room_id, 1), sync=False)
+    journal.append(JoinRoom(1001, 2, 2))
+    rooms = journal.rooms
+    journal.close()
+    names = os.listdir(tmp_path)
+    assert any(name.startswith("snapshot-") for name in names)
+    assert len(names) < 10  # スナップショット以前のセグメントは消える
+
+    journal = Journal(str(tmp_path), segment_size=4096, snapshot_every=500)
+    journal.open()
+    assert journal.rooms == rooms
+    journal.close()
+
+
+def test_snapshot_in_background(tmp_path, monkeypatch):
+    threads = []
+    snapshot = Journal._snapshot
+
+    def _snapshot(self):
+        threads.append(threading.current_thread().name)
+        return snapshot(self)
+
+    monkeypatch.setattr(Journal, "_snapshot", _snapshot)
+    journal = Journal(str(tmp_path), segment_size=4096, snapshot_every=100)
+    journal.open()
+    for room_id in range(1, 20):
+        journal.append(*_room_events(room_id))
+    journal.close()
+    assert threads
+    assert set(threads) == {"journal-snapshot"}  # 追記したスレッドでは取らない
+
+
+def test_lock(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.open()
+    journal.append(CreateRoom(1, 1001, 1, 1))
+
+    other = Journal(str(tmp_path))  # 2つ目のプロセス(ワーカー)
+    with pytest.raises(JournalLocked):
+        other.open()
+    journal.close()
+
+    other.open()  # 前のプロセスが終われば開ける
+    assert list(other.rooms) == [1]
+    other.close()
+
+
+def test_group_commit(tmp_path):
+    journal = Journal(str(tmp_path), snapshot_every=None)
+    journal.open()
+
+    def worker(room_id):
+        for event in _room_events(room_id):
+            journal.append(event)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert journal.rooms == {}
+    lsn = journal.lsn
+    journal.close()
+
+    journal = Journal(str(tmp_path), snapshot_every=None)
+    journal.open()
+    assert journal.lsn == lsn
+    journal.close()
+
+
+def test_torn_tail(tmp_path):
+    journal = Journal(str(tmp_path), snapshot_every=None)
+    journal.open()
+    journal.append(CreateRoom(1, 1001, 1, 1), JoinRoom(1, 2, 1))
+    lsn = journal.lsn
+    journal._mm[lsn : lsn + 10] = encode(JoinRoom(1, 3, 1))[:10]  # 書きかけでクラッシュ
+    far = lsn + 1024 * 1024  # 先に書き出されたページ, 間は穴になっている
+    record = encode(JoinRoom(1, 5, 1))
+    journal._mm[far : far + len(record)] = record
+    journal._mm.flush()
+    journal.close()  # LSN は進んでいないので書きかけのバイトはそのまま残る
+
+    journal = Journal(str(tmp_path), snapshot_every=None)
+    journal.open()
+    assert journal.lsn == lsn
+    assert journal._mm[far : far + len(record)] == bytes(len(record))
+    assert list(journal.rooms[1].members) == [1, 2]
+    journal.append(JoinRoom(1, 4, 1))
+    journal.close()
+
+    journal = Journal(str(tmp_path), snapshot_every=None)
+    journal.open()
+    assert list(journal.rooms[1].members) == [1, 2, 4]
+    journal.close()
+
+
+def test_open_journal_reseeds_from_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOURNAL_DIR", str(tmp_path))
+    monkeypatch.setattr(journal, "room_journal", None)
+    db_rooms = {}
+    for event in [CreateRoom(1, 1001, 1, 1), JoinRoom(1, 2, 2)]:
+        apply(db_rooms, event)
+
+    journal.open_journal(lambda: db_rooms)  # 空のジャーナル → DB の状態で取り直す
+    assert journal.room_journal.rooms == db_rooms
+    journal.record(StartRoom(1))
+    journal.close_journal()
+
+    apply(db_rooms, StartRoom(1))
+    journal.open_journal(lambda: db_rooms)  # 一致していればそのまま
+    assert journal.room_journal.rooms == db_rooms
+    journal.close_journal()
@@ -0,0 +1,115 @@
+import msgpack
+from fastapi.testclient import TestClient
+
+from app.api import app
+from app.negotiation import accepts_msgpack
+
+client = TestClient(app)
+msgpack_headers = {
+    "Content-Type": "application/msgpack",
+    "Accept": "application/msgpack",
+}
+
+
+def _post(path, body, token=None):
+    headers = dict(msgpack_headers)
+    if token is not None:
+        headers["Authorization"] = f"bearer {token}"
+    response = client.post(path, content=msgpack.packb(body), headers=headers)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/msgpack"
+    return msgpack.unpackb(response.content)
+
+
+def test_msgpack_room():
+    token = _post("/user/create", {"user_name": "msgpack", "leader_card_id": 1000})[
+        "user_token"
+    ]
+
+    room_id = _post("/room/create", {"live_id": 1001, "select_difficulty": 1}, token)[
+        "room_id"
+    ]
+
+    room_info_list = _post("/room/list", {"live_id": 1001})["room_info_list"]
+    assert room_id in [room_info["room_id"] for room_info in room_info_list]
+
+    res = _post("/room/wait", {"room_id": room_id}, token)
+    response = client.post(  # JSONと同じ形のレスポンス
+        "/room/wait",
+        headers={"Authorization": f"bearer {token}"},
+        json={"room_id": room_id},
+    )
+    assert response.headers["Content-Type"] == "application/json"
+    assert res == response.json()
+    assert res["room_user_list"][0]["is_me"]
+
+    _post("/room/leave", {"room_id": room_id}, token)
+
+
+def test_msgpack_user_me():
+    token = _post("/user/create", {"user_name": "msgpack", "leader_card_id": 1000})[
+        "user_token"
+    ]
+    response = client.get(
+        "/user/me",
+        headers={"Authorization": f"bearer {token}", "Accept": "application/msgpack"},
+    )
+    assert response.status_code == 200
+    assert msgpack.unpackb(response.content).keys() == {"id", "name", "leader_card_id"}
+
+
+def test_msgpack_errors():
+    response = client.get(  # HTTPException
+        "/user/me",
+        headers={"Authorization": "bearer invalid", "Accept": "application/msgpack"},
+    )
+    assert response.status_code == 404
+    assert response.headers["Content-Type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == {"detail": "Not Found"}
+
+    response = client.post(  # 壊れたボディ
+        "/room/list", content=b"\xc1", headers=msgpack_headers
+    )
+    assert response.status_code == 400
+    assert response.headers["Content-Type"] == "application/msgpack"
+    assert "detail" in msgpack.unpackb(response.content)
+
+    response = client.post(  # バリデーションエラー
+        "/room/list", content=msgpack.packb({}), headers=msgpack_headers
+    )
+    assert response.status_code == 422
+    assert response.headers["Content-Type"] == "application/msgpack"
+    detail = msgpack.unpackb(response.content)["detail"]
+    assert detail[0]["loc"] == ["body", "live_id"]
+
+    response = client.post("/room/list", json={})  # JSON のクライアントには JSON
+    assert response.status_code == 422
+    assert response.headers["Content-Type"] == "application/json"
+    assert response.json()["detail"] == detail
+
+
+def test_accepts_msgpack():
+    assert accepts_msgpack("application/msgpack")
+    assert accepts_msgpack("application/x-msgpack")
+    assert accepts_msgpack("application/json;q=0.5, application/msgpack")
+    assert accepts_msgpack("*/*;q=0.1, application/msgpack;foo=bar;q=0.9")
+    assert not accepts_msgpack("")
+    assert not accepts_msgpack("application/json")
+    assert not accepts_msgpack("*/*")
+    assert not accepts_msgpack("application/msgpack;q=0")
+    assert not accepts_msgpack("application/json, application/msgpack;q=0.5")
+    assert not accepts_msgpack("application/json, application/msgpack")  # 同順位は JSON
+    assert not accepts_msgpack("*/*, application/msgpack;foo=bar;q=0.9")
+
+
+def test_openapi():
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+
+    response = client.post(  # JSON を優先するクライアントには JSON
+        "/user/create",
+        headers={"Accept": "application/json, application/msgpack;q=0.5"},
+        json={"user_name": "msgpack", "leader_card_id": 1000},
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/json"
@@ -0,0 +1,90 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import config
+from app.api import app
+from app.profiler import profiler
+
+client = TestClient(app)
+admin_token = "test_admin_token"
+capture_key = "test_capture_key"
+
+
+@pytest.fixture
+def admin_header(monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", admin_token)
+    monkeypatch.setattr(config, "PROFILE_CAPTURE_KEY", capture_key)
+    yield {"X-Admin-Token": admin_token}
+    profiler.configure(False)
+    profiler.reset()
+
+
+def test_profile_requires_admin(admin_header):
+    response = client.get("/admin/profile")
+    assert response.status_code == 403
+
+    response = client.get("/admin/profile", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+
+    response = client.get(  # 非 ASCII のトークン
+        "/admin/profile", headers={"X-Admin-Token": "é".encode("latin-1")}
+    )
+    assert response.status_code == 403
+
+
+def test_profile_sampling_and_capture(admin_header):
+    response = client.post(
+        "/admin/profile", headers=admin_header, json={"enabled": True, "sample_rate": 1}
+    )
+    assert response.status_code == 200
+    assert response.json()["enabled"]
+
+    response = client.post(
+        "/user/create", json={"user_name": "profiled", "leader_card_id": 1000}
+    )
+    assert response.status_code == 200
+    auth_header = {"Authorization": f"bearer {response.json()['user_token']}"}
+
+    for _ in range(1000):  # サンプラーが /user/me を採取するまで叩く
+        response = client.get("/user/me", headers=auth_header)
+        assert response.status_code == 200
+        if "/user/me" in profiler.routes():
+            break
+
+    response = client.get("/admin/profile", headers=admin_header)
+    assert response.status_code == 200
+    assert response.json()["route_sample_count"]["/user/me"] > 0
+
+    response = client.get(  # エンドポイント自身の route 引数と衝突しない
+        "/admin/profile/flamegraph", headers=admin_header, params={"route": "/user/me"}
+    )
+    assert response.status_code == 200
+    assert "attachment" in response.headers["Content-Disposition"]
+    lines = response.text.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("/user/me;")
+        assert int(count) > 0
+
+    response = client.post(
+        "/admin/profile", headers=admin_header, json={"enabled": False}
+    )
+    assert response.status_code == 200
+    assert not response.json()["enabled"]
+
+    response = client.get(  # 管理用トークンではキャプチャしない
+        "/user/me", headers={**auth_header, "X-Profile-Capture": admin_token}
+    )
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+
+    response = client.get(  # サンプリングが無効でもヘッダー指定でフルプロファイル
+        "/user/me", headers={**auth_header, "X-Profile-Capture": capture_key}
+    )
+    assert response.status_code == 200
+    capture_id = response.headers["X-Profile-Id"]
+
+    response = client.get(f"/admin/profile/capture/{capture_id}", headers=admin_header)
+    assert response.status_code == 200
+    assert "get_user_by_token" in response.text
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+
+from app import model
+from app.db import ReplicaPool
+
+
+def _create_db(path):
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE `user` (`id` INTEGER PRIMARY KEY, `name` TEXT, `token` TEXT, `leader_card_id` INTEGER)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE `room` (`room_id` INTEGER PRIMARY KEY, `live_id` INTEGER, `start` INTEGER DEFAULT 0)"
+            )
+        )
+    return engine
+
+
+def _create_pool(tmp_path, lag, primary=None):
+    if primary is None:
+        primary = _create_db(tmp_path / "primary.db")
+    replica = _create_db(tmp_path / "replica.db")
+    pool = ReplicaPool(
+        primary,
+        [replica],
+        max_lag=1.0,
+        sticky_seconds=0.5,
+        lag_probe=lambda engine: lag["value"],  # 遅延を模擬する
+    )
+    pool.refresh()
+    return pool, primary, replica
+
+
+def test_replica_routing(tmp_path):
+    lag = {"value": 0.0}
+    pool, primary, replica = _create_pool(tmp_path, lag)
+    assert pool.engine_for() is replica
+    assert pool.engine_for(0.1) is primary  # 直前に書き込んだユーザー
+    assert pool.engine_for(10) is replica
+
+    lag["value"] = 0.8
+    pool.refresh()
+    assert pool.engine_for(0.6) is primary  # 書き込みがまだ届いていない
+    assert pool.engine_for(0.9) is replica
+
+    lag["value"] = 5.0  # 遅延が大きい → primary にフォールバック
+    pool.refresh()
+    assert pool.engine_for() is primary
+
+    lag["value"] = None  # レプリケーション停止
+    pool.refresh()
+    assert pool.engine_for() is primary
+
+
+def test_read_your_writes(tmp_path, monkeypatch):
+    lag = {"value": 0.0}
+    pool, primary, replica = _create_pool(tmp_path, lag)
+    monkeypatch.setattr(model, "replicas", pool)
+
+    token = "replica_test_token"
+    with primary.begin() as conn:  # primary にだけ書き込まれ, レプリカには未到達
+        conn.execute(
+            text(
+                "INSERT INTO `user` (`name`, `token`, `leader_card_id`) VALUES ('replica', :token, 1000)"
+            ),
+            dict(token=token),
+        )
+    model._mark_write(token)
+    user = model.get_user_by_token(token)  # 書き込んだ本人は primary から読む
+    assert user is not None
+    assert user.name == "replica"
+
+    monkeypatch.setitem(model._last_write, token, time.monotonic() - 10)
+    assert model.get_user_by_token(token) is None  # 時間が経てばレプリカから読む
+
+
+def test_join_then_wait(tmp_path, monkeypatch):
+    # primary は本物の DB, レプリカは書き込みが一切届いていない(大きく遅れた)空の DB.
+    # 遅延の確認では遅れていないと報告させ, 書き込み時刻による振り分けだけを確かめる
+    lag = {"value": 0.0}
+    pool, primary, replica = _create_pool(tmp_path, lag, primary=model.engine)
+    monkeypatch.setattr(model, "replicas", pool)
+
+    host = model.create_user("replica_host", 1000)
+    guest = model.create_user("replica_guest", 1000)
+    room_id = model.create_room(host, 1001, 1)
+    assert model.join_room(guest, room_id, 1) == 1
+
+    status, room_user_list = model.wait_room(guest, room_id)  # join 直後の wait
+    assert status == model.WaitRoomStatus.Waiting
+    me = [room_user for room_user in room_user_list if room_user.is_me]
+    assert len(me) == 1
+    assert me[0].name == "replica_guest"
+
+    monkeypatch.setitem(model._last_write, guest, time.monotonic() - 10)
+    status, room_user_list = model.wait_room(guest, room_id)  # レプリカから読む
+    assert status == model.WaitRoomStatus.Dissolution
+    assert room_user_list == []
+
+    model.leave_room(guest, room_id)
+    model.leave_room(host, room_id)
+
+
+def test_write_waits_past_sticky_window(tmp_path, monkeypatch):
+    # ロック待ちで書き込みが REPLICA_STICKY_SECONDS より長くかかっても,
+    # コミットしてからの読み取りは primary に行く
+    lag = {"value": 0.0}
+    pool, primary, replica = _create_pool(tmp_path, lag, primary=model.engine)
+    monkeypatch.setattr(model, "replicas", pool)
+
+    host = model.create_user("replica_host", 1000)
+    guest = model.create_user("replica_guest", 1000)
+    room_id = model.create_room(host, 1001, 1)
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(model.join_room(guest, room_id, 1))
+    )
+    with model.engine.begin() as conn:  # 別のトランザクションが部屋をロックしている
+        conn.execute(
+            text(
+                "SELECT COUNT(`id`) FROM `room_member` WHERE `room_id`=:room_id FOR UPDATE"
+            ),
+            dict(room_id=room_id),
+        )
+        thread.start()
+        # join_room はロック待ちのまま期間を過ぎる
+        time.sleep(pool.sticky_seconds + 0.2)
+    thread.join()
+    assert results == [1]
+
+    status, room_user_list = model.wait_room(guest, room_id)
+    assert status == model.WaitRoomStatus.Waiting
+    assert [room_user.name for room_user in room_user_list if room_user.is_me] == [
+        "replica_guest"
+    ]
+
+    model.leave_room(guest, room_id)
+    model.leave_room(host, room_id)